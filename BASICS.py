@@ -1,10 +1,17 @@
+import asyncio
+import os
+import sqlite3
+from contextlib import contextmanager
 from enum import IntEnum
-from typing import List, Optional
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Protocol
 
+import orjson
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
-api = FastAPI()
+api = FastAPI(default_response_class=ORJSONResponse) # orjson serializes responses in C
 
 class Priority(IntEnum):
     LOW = 1
@@ -35,21 +42,194 @@ class TodoUpdate(BaseModel):
 
 #Not an actual DB just dictionary to simulate data storage
 
+# Raw seed data. Todo objects are built on startup (see seed_todos), not at import time
 all_todos = [
-    Todo(todo_id=1, todo_name="Buy groceries", todo_description="Milk, Bread, Eggs", priority=Priority.MEDIUM),
-    Todo(todo_id=2, todo_name="Read a book", todo_description="Finish reading '1984' by George Orwell", priority=Priority.LOW),
-    Todo(todo_id=3, todo_name="Workout", todo_description="Go for a 30-minute run", priority=Priority.HIGH),
-    Todo(todo_id=4, todo_name="Call Mom", todo_description="Check in with Mom and see how she's doing", priority=Priority.MEDIUM),
-    Todo(todo_id=5, todo_name="Clean House", todo_description="Vacuum and dust all rooms", priority=Priority.LOW)
+    dict(todo_id=1, todo_name="Buy groceries", todo_description="Milk, Bread, Eggs", priority=Priority.MEDIUM),
+    dict(todo_id=2, todo_name="Read a book", todo_description="Finish reading '1984' by George Orwell", priority=Priority.LOW),
+    dict(todo_id=3, todo_name="Workout", todo_description="Go for a 30-minute run", priority=Priority.HIGH),
+    dict(todo_id=4, todo_name="Call Mom", todo_description="Check in with Mom and see how she's doing", priority=Priority.MEDIUM),
+    dict(todo_id=5, todo_name="Clean House", todo_description="Vacuum and dust all rooms", priority=Priority.LOW)
 ]
 
 
 
+class TodoStore(Protocol): # Storage used by the endpoints
+    async def seed(self, todos: List[Todo]) -> None: ...
+    async def get(self, todo_id: int) -> Optional[Todo]: ...
+    async def list(self, first_n: Optional[int] = None) -> List[Todo]: ...
+    async def create(self, todo: TodoCreate) -> Todo: ...
+    async def create_many(self, todos: List[TodoCreate]) -> List[Todo]: ...
+    async def update(self, todo_id: int, changes: Dict[str, Any]) -> Optional[Todo]: ...
+    async def delete(self, todo_id: int) -> Optional[Todo]: ...
+
+
+class InMemoryTodoStore:
+    """
+    Per-process store (default). Only valid with a single uvicorn worker.
+    Index by todo_id so lookups, updates and deletes are O(1). Dicts keep insertion order, so listing stays ordered.
+    No locking needed: there is no await inside any operation, so each one runs atomically on the event loop.
+    """
+    def __init__(self):
+        self.todos_by_id: Dict[int, Todo] = {}
+        self._next_id = 1
+
+    async def seed(self, todos: List[Todo]) -> None:
+        if not self.todos_by_id:
+            self.todos_by_id = {todo.todo_id: todo for todo in todos}
+            self._next_id = max(self.todos_by_id, default=0) + 1
+
+    async def get(self, todo_id: int) -> Optional[Todo]:
+        return self.todos_by_id.get(todo_id)
+
+    async def list(self, first_n: Optional[int] = None) -> List[Todo]:
+        if first_n and first_n > 0:
+            return list(islice(self.todos_by_id.values(), first_n))
+        todos = list(self.todos_by_id.values())
+        return todos[:first_n] if first_n else todos # Negative: list slice semantics (all but the last -first_n)
+
+    async def create(self, todo: TodoCreate) -> Todo:
+        return self._insert(todo)
+
+    async def create_many(self, todos: List[TodoCreate]) -> List[Todo]:
+        return [self._insert(todo) for todo in todos]
+
+    def _insert(self, todo: TodoCreate) -> Todo:
+        new_todo = Todo(
+            todo_id=self._next_id,
+            todo_name=todo.todo_name,
+            todo_description=todo.todo_description,
+            priority=todo.priority)
+        self.todos_by_id[new_todo.todo_id] = new_todo
+        self._next_id += 1
+        return new_todo
+
+    async def update(self, todo_id: int, changes: Dict[str, Any]) -> Optional[Todo]:
+        todo = self.todos_by_id.get(todo_id)
+        if todo is not None:
+            for field, value in changes.items():
+                setattr(todo, field, value)
+        return todo
+
+    async def delete(self, todo_id: int) -> Optional[Todo]:
+        return self.todos_by_id.pop(todo_id, None)
+
+
+class SqliteTodoStore:
+    """
+    SQLite store in WAL mode, shared by every uvicorn worker that points at the same file.
+    sqlite3 is blocking, so every operation runs in a thread (asyncio.to_thread) with its own connection.
+    """
+    _COLUMNS = "todo_id, todo_name, todo_description, priority"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def seed(self, todos: List[Todo]) -> None: # Also creates the table on first run
+        def run():
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS todos ("
+                    "todo_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    "todo_name TEXT NOT NULL, "
+                    "todo_description TEXT NOT NULL, "
+                    "priority INTEGER NOT NULL)")
+                # Every worker seeds at startup: take the write lock before checking, so only one inserts
+                conn.execute("BEGIN IMMEDIATE")
+                if conn.execute("SELECT COUNT(*) FROM todos").fetchone()[0] == 0:
+                    conn.executemany(
+                        f"INSERT INTO todos ({self._COLUMNS}) VALUES (?, ?, ?, ?)",
+                        [(t.todo_id, t.todo_name, t.todo_description, int(t.priority)) for t in todos])
+        await asyncio.to_thread(run)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]: # Commits (or rolls back) and closes
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_todo(row) -> Todo:
+        return Todo(todo_id=row[0], todo_name=row[1], todo_description=row[2], priority=row[3])
+
+    def _get(self, conn: sqlite3.Connection, todo_id: int) -> Optional[Todo]:
+        row = conn.execute(f"SELECT {self._COLUMNS} FROM todos WHERE todo_id = ?", (todo_id,)).fetchone()
+        return self._to_todo(row) if row else None
+
+    async def get(self, todo_id: int) -> Optional[Todo]:
+        def run():
+            with self._connect() as conn:
+                return self._get(conn, todo_id)
+        return await asyncio.to_thread(run)
+
+    async def list(self, first_n: Optional[int] = None) -> List[Todo]:
+        def run():
+            # Same semantics as list[:first_n]; LIMIT -1 means no limit in SQLite
+            limit = "MAX((SELECT COUNT(*) FROM todos) + ?, 0)" if first_n and first_n < 0 else "?"
+            with self._connect() as conn:
+                rows = conn.execute(
+                    f"SELECT {self._COLUMNS} FROM todos ORDER BY todo_id LIMIT {limit}", (first_n or -1,)).fetchall()
+            return [self._to_todo(row) for row in rows]
+        return await asyncio.to_thread(run)
+
+    async def create(self, todo: TodoCreate) -> Todo:
+        return (await self.create_many([todo]))[0]
+
+    async def create_many(self, todos: List[TodoCreate]) -> List[Todo]:
+        def run():
+            created = []
+            with self._connect() as conn: # One transaction for the whole batch
+                for todo in todos:
+                    cur = conn.execute(
+                        "INSERT INTO todos (todo_name, todo_description, priority) VALUES (?, ?, ?)",
+                        (todo.todo_name, todo.todo_description, int(todo.priority)))
+                    created.append(Todo(todo_id=cur.lastrowid, **todo.model_dump()))
+            return created
+        return await asyncio.to_thread(run)
+
+    async def update(self, todo_id: int, changes: Dict[str, Any]) -> Optional[Todo]:
+        def run():
+            with self._connect() as conn:
+                if changes: # Column names come from TodoUpdate fields, never from user input
+                    assignments = ", ".join(f"{field} = ?" for field in changes)
+                    conn.execute(
+                        f"UPDATE todos SET {assignments} WHERE todo_id = ?",
+                        (*(int(v) if isinstance(v, Priority) else v for v in changes.values()), todo_id))
+                return self._get(conn, todo_id)
+        return await asyncio.to_thread(run)
+
+    async def delete(self, todo_id: int) -> Optional[Todo]:
+        def run():
+            with self._connect() as conn:
+                todo = self._get(conn, todo_id)
+                if todo is not None:
+                    conn.execute("DELETE FROM todos WHERE todo_id = ?", (todo_id,))
+                return todo
+        return await asyncio.to_thread(run)
+
+
+# Set TODO_DB_PATH to share state between workers, e.g.:
+#   TODO_DB_PATH=todos.db uvicorn BASICS:api --workers $(nproc)
+# Without it, state lives in this process only, so run a single worker.
+_db_path = os.environ.get("TODO_DB_PATH")
+store: TodoStore = SqliteTodoStore(_db_path) if _db_path else InMemoryTodoStore()
+
+
+@api.on_event("startup")
+async def seed_todos():
+    # Seed data is trusted, so model_construct skips validation. Runs once per worker
+    await store.seed([Todo.model_construct(**todo) for todo in all_todos])
+
+
+
 
 # GET, POST, PUT, DELETE, PATCH, OPTIONS, HEAD
 
 @api.get("/")
-def index():
+async def index():
     return {"message": "Hello, World!"}
 
 
@@ -58,54 +238,49 @@ def index():
 
 
 
+@api.get('/todos/stream') # Declared before /todos/{todo_id} so "stream" is not parsed as an id
+async def stream_todos(first_n: int = None):
+    todos = await store.list(first_n)
+
+    async def ndjson(): # One JSON object per line; async so Starlette does not iterate it in the threadpool
+        for todo in todos:
+            yield orjson.dumps(todo.model_dump()) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
 @api.get("/todos/{todo_id}", response_model=Todo) # Path Parameter
-def get_todo(todo_id: int):
-    for todo in all_todos:
-        if todo.todo_id == todo_id:
-            return todo
-    raise HTTPException(status_code=404, detail="Todo not found")
+async def get_todo(todo_id: int):
+    todo = await store.get(todo_id)
+    if todo is None:
+        raise HTTPException(status_code=404, detail="Todo not found")
+    return todo
         
 @api.get('/todos', response_model=List[Todo]) # Query Parameter /todos?first_n=2
-def get_todos(first_n: int = None): # It's important to specify types
-    if first_n:
-        return all_todos[:first_n]
-    else:
-        return all_todos
+async def get_todos(first_n: int = None): # It's important to specify types
+    todos = await store.list(first_n)
+    # The store only holds Todo objects, so skip re-validating every item through response_model
+    return ORJSONResponse([todo.model_dump() for todo in todos])
 
 
 @api.post('/todos', response_model=Todo)
-def create_todo(todo: TodoCreate): # TodoCreate does not have todo_id
-    new_todo_id = max(todo.todo_id for todo in all_todos) + 1
-
-    new_todo = Todo(
-        todo_id=new_todo_id,
-        todo_name=todo.todo_name,
-        todo_description=todo.todo_description,
-        priority=todo.priority)
-
+async def create_todo(todo: TodoCreate): # TodoCreate does not have todo_id
+    return await store.create(todo)
 
-    all_todos.append(new_todo)
-
-    return new_todo
+@api.post('/todos/batch', response_model=List[Todo])
+async def create_todos(todos: List[TodoCreate]): # Several todos in one request
+    return await store.create_many(todos)
 
 @api.put('/todos/{todo_id}', response_model=Todo)
-def update_todo(todo_id: int, updated_todo: TodoUpdate):
-    for todo in all_todos:
-        if todo.todo_id == todo_id:
-            if updated_todo.todo_name is not None:
-                todo.todo_name = updated_todo.todo_name
-            if updated_todo.todo_description is not None:
-                todo.todo_description = updated_todo.todo_description
-            if updated_todo.priority is not None:
-                todo.priority = updated_todo.priority
-            return todo
-    raise HTTPException(status_code=404, detail="Todo not found")
+async def update_todo(todo_id: int, updated_todo: TodoUpdate):
+    # Only the fields that were sent (not None) are applied
+    todo = await store.update(todo_id, updated_todo.model_dump(exclude_none=True))
+    if todo is None:
+        raise HTTPException(status_code=404, detail="Todo not found")
+    return todo
 
 @api.delete('/todos/{todo_id}', response_model=Todo)
-def delete_todo(todo_id: int):
-    for index, todo in enumerate(all_todos):
-        if todo.todo_id == todo_id:
-            deleted_todo = all_todos.pop(index)
-            return deleted_todo
-    raise HTTPException(status_code=404, detail="Todo not found")
-
+async def delete_todo(todo_id: int):
+    deleted_todo = await store.delete(todo_id)
+    if deleted_todo is None:
+        raise HTTPException(status_code=404, detail="Todo not found")
+    return deleted_todo
@@ -15,12 +15,17 @@ def most_overlap_index(arr1, arr2):
     """
     ind = None
     overlapped_size = 20 # guess
-    for i in range(1, int(len(arr1)/2)):
-        diff_arr = arr1[i:] - arr2[:-i]
-        zeros_count = len(diff_arr) - np.count_nonzero(diff_arr)
-        if overlapped_size < zeros_count:
-            ind = i
-            overlapped_size = zeros_count
+    half = len(arr1) // 2
+    if half < 2:
+        return ind, overlapped_size
+    # zeros_count for every shift i at once: equal pairs arr1[i + k] == arr2[k] lie on diagonal i
+    rows, cols = np.nonzero(arr1[:, None] == arr2[None, :])
+    shifts = rows - cols
+    zeros_counts = np.bincount(shifts[shifts > 0], minlength=half)[1:half]
+    best = int(np.argmax(zeros_counts)) # first shift with the biggest overlap, like the original loop
+    if overlapped_size < zeros_counts[best]:
+        ind = best + 1
+        overlapped_size = int(zeros_counts[best])
     return ind, overlapped_size
 
 
@@ -38,18 +43,38 @@ def diff_subset_range(arr1, arr2):
     return (min(non_zero_indeces),max(non_zero_indeces))
 
 
-def add_new_data(aggregated_data, arr1, arr2):       
+def merge_into(out, length, arr1, arr2):
+    """
+    Same overlap/reset logic as add_new_data, but writes into a caller-owned buffer instead of
+    building a new array, so appending costs O(new values) instead of copying the whole aggregate.
+
+    :param out: numpy array, aggregated data is out[:length]; must have room for len(arr2) more values
+    :param length: number of valid values in out
+    :param arr1: previous window (numpy array)
+    :param arr2: new window (numpy array)
+    :returns new_length: number of valid values in out after merging
+    :returns start: index where this merge started writing; out[start:new_length] are the new values
+                    (start can be lower than length when the end of the aggregate was replaced)
+    """
     ind, zeros = most_overlap_index(arr1, arr2)
     if ind:
         bad_ending_count = -(64 - ind - zeros)
-        aggregator_striped =  aggregated_data[:bad_ending_count] if bad_ending_count < 0 else aggregated_data
+        start = max(length + bad_ending_count, 0) if bad_ending_count < 0 else length
         new_values = arr2[-ind:]
-        result = np.append(aggregator_striped, new_values)        
     else:  #when ind is None usually when there is reset in ppg algorithm on infinitime
         inds = diff_subset_range(arr1 , arr2)
+        start = length
         new_values=(arr2)[inds[0]:inds[1]+1]
-        result = np.append(aggregated_data, new_values)
-    return result
+    new_length = start + len(new_values)
+    out[start:new_length] = new_values
+    return new_length, start
+
+
+def add_new_data(aggregated_data, arr1, arr2):
+    out = np.empty(len(aggregated_data) + len(arr2), dtype=np.result_type(aggregated_data, arr2))
+    out[:len(aggregated_data)] = aggregated_data
+    new_length, _ = merge_into(out, len(aggregated_data), arr1, arr2)
+    return out[:new_length]
 
 
 async def process(data_generator, iteration_listener_func = None):
@@ -1,21 +1,28 @@
 from __future__ import annotations
 
 import asyncio
+import sys
 import time
 import struct
 
 import numpy as np
+import orjson
 import hrs_analysis_tools
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Union
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Awaitable, Callable, Dict, Hashable, List, Literal, Optional, Tuple, Union
 
 from fastapi import FastAPI, Query, HTTPException, WebSocket, WebSocketDisconnect
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from bleak import BleakScanner, BleakClient
-from bleak.exc import BleakError
+from bleak.backends.device import BLEDevice
+from bleak.backends.characteristic import BleakGATTCharacteristic
+from bleak.exc import BleakCharacteristicNotFoundError, BleakError
 
 
-api = FastAPI(title="BLE Scanner API")
+# ORJSONResponse: serialización JSON en C (orjson) en lugar del módulo json estándar
+api = FastAPI(title="BLE Scanner API", default_response_class=ORJSONResponse)
 
 
 # -----------------------
@@ -69,6 +76,19 @@ class BLEConnectPersistentByAddressSuccess(BaseModel):
     is_connected: bool
 
 
+class BLEConnectBatchItem(BaseModel):
+    """Modelo de entrada para un elemento de conexión persistente en lote."""
+    address: str = Field(..., min_length=1, description="Address (MAC/ID) del dispositivo BLE")
+    connect_timeout: float = Field(10.0, ge=1.0, le=60.0, description="Tiempo máximo de conexión en segundos")
+
+
+class BLEConnectBatchResult(BaseModel):
+    """Modelo de respuesta por dispositivo para conexión persistente en lote."""
+    address: str
+    is_connected: bool
+    error: Optional[str] = None
+
+
 class PPGReadResponse(BaseModel):
     """Modelo de respuesta para lectura de datos PPG (64 muestras uint16)."""
     address: str
@@ -77,6 +97,13 @@ class PPGReadResponse(BaseModel):
     samples: List[int]  # 64 samples (uint16)
 
 
+class PPGSnapshotResponse(BaseModel):
+    """Modelo de respuesta con el arreglo PPG agregado completo de la última sesión WebSocket."""
+    address: str
+    aggregated_len: int
+    aggregated: List[int]
+
+
 class BLEDisconnectResponse(BaseModel):
     """Modelo de respuesta para desconexión de dispositivo BLE."""
     message: str
@@ -99,17 +126,43 @@ class BLEConnectionsList(BaseModel):
 # Connection Manager (persistencia real)
 # -----------------------
 
+class BLENotConnectedError(BleakError):
+    """No hay conexión persistente (activa) para el address pedido."""
+
+
+class BLEAmbiguousCharacteristicError(BleakError):
+    """El UUID pedido coincide con varias características del dispositivo."""
+
+
+class ConnState(Enum):
+    """Estados de una conexión persistente."""
+    DISCONNECTED = "disconnected"
+    CONNECTING = "connecting"
+    CONNECTED = "connected"
+    DISCONNECTING = "disconnecting"
+
+
 @dataclass
 class ManagedConnection:
     """
     Contenedor para una conexión BLE persistente.
     - client: cliente BLE (BleakClient)
-    - lock: lock asincrónico para evitar accesos concurrentes al mismo dispositivo
+    - state: estado actual de la conexión (ConnState)
+    - state_changed: evento que despierta a quienes esperan la siguiente transición de estado
     - last_name: nombre del dispositivo (opcional)
+    - chars: características GATT ya resueltas por UUID (se limpia en cada conexión)
     """
-    client: BleakClient
-    lock: asyncio.Lock
+    client: Optional[BleakClient] = None
+    state: ConnState = ConnState.DISCONNECTED
+    state_changed: asyncio.Event = field(default_factory=asyncio.Event)
     last_name: Optional[str] = None
+    chars: Dict[str, BleakGATTCharacteristic] = field(default_factory=dict)
+
+    def set_state(self, state: ConnState) -> None:
+        """Cambia de estado y notifica a quienes esperan (set + clear despierta a los que ya esperan)."""
+        self.state = state
+        self.state_changed.set()
+        self.state_changed.clear()
 
 
 class BLEConnectionManager:
@@ -117,34 +170,60 @@ class BLEConnectionManager:
     Gestor de conexiones BLE persistentes en memoria.
     Mantiene un diccionario de conexiones activas (address -> ManagedConnection).
     - Permite conectar, desconectar y consultar estado de dispositivos.
-    - Usa locks para evitar condiciones de carrera.
+    - El lock global solo se toma para mutar el diccionario; las lecturas van sin lock.
+      Es seguro porque asyncio corre en un solo hilo: una lectura del dict sin await de por
+      medio nunca ve un estado intermedio de una inserción/eliminación.
+    - Cada conexión es una pequeña máquina de estados (ConnState): quien llega durante
+      una transición espera el evento `state_changed` en lugar de hacer cola en un lock.
     """
     def __init__(self) -> None:
         self._connections: Dict[str, ManagedConnection] = {}
         self._global_lock = asyncio.Lock()
+        # nombre normalizado -> (time.monotonic() de la búsqueda, [(address, rssi), ...])
+        self._name_cache: Dict[str, Tuple[float, List[Tuple[str, Optional[int]]]]] = {}
+
+    def remember_name(self, name: str, candidates: List[Tuple[str, Optional[int]]]) -> None:
+        """Guarda las addresses encontradas para `name` en la última búsqueda."""
+        if candidates:
+            self._name_cache[name.strip().lower()] = (time.monotonic(), list(candidates))
+
+    def cached_name(self, name: str, max_age: float) -> List[Tuple[str, Optional[int]]]:
+        """Addresses conocidas para `name` si la búsqueda tiene menos de `max_age` segundos."""
+        entry = self._name_cache.get(name.strip().lower())
+        if entry is None or time.monotonic() - entry[0] >= max_age:
+            return []
+        return list(entry[1])
+
+    def forget_name_addresses(self, name: str, addresses: List[str]) -> None:
+        """Invalida addresses del cache de nombres (p. ej. tras un fallo de conexión)."""
+        key = name.strip().lower()
+        entry = self._name_cache.get(key)
+        if entry is None or not addresses:
+            return
+        remaining = [c for c in entry[1] if c[0] not in addresses]
+        if remaining:
+            self._name_cache[key] = (entry[0], remaining)
+        else:
+            del self._name_cache[key]
 
     async def is_connected(self, address: str) -> bool:
         """
         Verifica si un dispositivo está conectado.
-        Compatible con diferentes versiones de bleak.
+        Lectura pura del estado: sin lock y sin consultar al cliente BLE
+        (las desconexiones inesperadas llegan por `disconnected_callback`).
         """
-        async with self._global_lock:
-            managed = self._connections.get(address)
-        if not managed:
-            return False
-        # bleack client: is_connected() puede ser async o property según versión; manejamos ambos
-        try:
-            ic = managed.client.is_connected
-            if callable(ic):
-                return bool(await ic())
-            return bool(ic)
-        except Exception:
-            return False
+        managed = self._connections.get(address)
+        return managed is not None and managed.state is ConnState.CONNECTED
 
     async def get_connections(self) -> List[str]:
         """Retorna lista de addresses de todas las conexiones persistentes."""
+        return list(self._connections)
+
+    async def _forget(self, address: str, managed: ManagedConnection) -> None:
+        """Elimina `managed` del registro (solo si sigue siendo la entrada de `address`)."""
         async with self._global_lock:
-            return list(self._connections.keys())
+            if self._connections.get(address) is managed:
+                del self._connections[address]
 
     async def connect_persistent(
         self,
@@ -155,83 +234,430 @@ class BLEConnectionManager:
         """
         Conecta y mantiene el cliente en memoria.
         Si ya existe conexión para address, intenta re-usarla.
+        Si otra petición está conectando el mismo address, espera su resultado.
         Retorna True si la conexión es exitosa.
         """
-        async with self._global_lock:
-            managed = self._connections.get(address)
-            if not managed:
-                # Crear nuevo cliente BLE si no existe
-                client = BleakClient(address, timeout=connect_timeout)
-                managed = ManagedConnection(client=client, lock=asyncio.Lock(), last_name=name)
-                self._connections[address] = managed
-
-        # Lock por dispositivo para evitar conectar dos veces simultáneamente
-        async with managed.lock:
-            # Si ya está conectado, no es necesario reconectar
-            if await self.is_connected(address):
+        while True:
+            async with self._global_lock:
+                managed = self._connections.get(address)
+                if not managed:
+                    # Crear nuevo cliente BLE si no existe
+                    managed = ManagedConnection(last_name=name)
+                    managed.client = BleakClient(
+                        address,
+                        disconnected_callback=lambda _c, m=managed: self._on_disconnected(m),
+                        timeout=connect_timeout,
+                    )
+                    self._connections[address] = managed
+
+            if managed.state is ConnState.CONNECTED:
+                # Ya está conectado, no es necesario reconectar
                 managed.last_name = name or managed.last_name
                 return True
 
+            if managed.state is ConnState.CONNECTING:
+                # Otra petición está conectando: esperar su resultado
+                await managed.state_changed.wait()
+                return managed.state is ConnState.CONNECTED
+
+            if managed.state is ConnState.DISCONNECTING:
+                # Esperar a que termine la desconexión y volver a empezar con una entrada nueva
+                await managed.state_changed.wait()
+                continue
+
+            # DISCONNECTED -> CONNECTING sin await de por medio (atómico en el event loop)
+            managed.set_state(ConnState.CONNECTING)
             try:
                 await managed.client.connect()
-                managed.last_name = name or managed.last_name
-            except Exception:
-                # Si falla, limpiamos el registro para no dejar basura
-                async with self._global_lock:
-                    self._connections.pop(address, None)
+            except BaseException:
+                # Si falla (o se cancela), limpiamos el registro para no dejar basura
+                managed.set_state(ConnState.DISCONNECTED)
+                await self._forget(address, managed)
                 raise
 
-            return await self.is_connected(address)
+            managed.last_name = name or managed.last_name
+            # Tras (re)conectar los servicios se vuelven a descubrir: descartar características viejas
+            managed.chars.clear()
+            managed.set_state(ConnState.CONNECTED)
+            # connect() lanza excepción si falla: llegar aquí ya significa conectado
+            return True
+
+    def _on_disconnected(self, managed: ManagedConnection) -> None:
+        """Callback de bleak cuando el dispositivo se desconecta por su cuenta."""
+        if managed.state is ConnState.CONNECTED:
+            managed.set_state(ConnState.DISCONNECTED)
 
     async def disconnect(self, address: str) -> bool:
         """
         Desconecta y elimina el cliente de memoria.
         Retorna True si el dispositivo estaba conectado al momento de desconectar.
         """
-        async with self._global_lock:
-            managed = self._connections.get(address)
+        managed = self._connections.get(address)
 
         if not managed:
             return False
 
-        async with managed.lock:
-            was = await self.is_connected(address)
-            try:
-                await managed.client.disconnect()
-            except Exception:
-                # aunque falle el disconnect, removemos para evitar bloqueo permanente
-                pass
+        # Si hay una conexión en curso, esperar a que termine antes de desconectar
+        while managed.state is ConnState.CONNECTING:
+            await managed.state_changed.wait()
 
-            async with self._global_lock:
-                self._connections.pop(address, None)
+        if managed.state is ConnState.DISCONNECTING:
+            # Otra petición ya está desconectando este address
+            await managed.state_changed.wait()
+            return False
+
+        was = managed.state is ConnState.CONNECTED
+        managed.set_state(ConnState.DISCONNECTING)
+        try:
+            await managed.client.disconnect()
+        except Exception:
+            # aunque falle el disconnect, removemos para evitar bloqueo permanente
+            pass
+        managed.set_state(ConnState.DISCONNECTED)
+        managed.chars.clear()
 
-            return was
+        await self._forget(address, managed)
+        return was
 
     async def disconnect_all(self) -> None:
         """Desconecta todos los dispositivos registrados."""
         addrs = await self.get_connections()
-        for a in addrs:
-            try:
-                await self.disconnect(a)
-            except Exception:
-                pass
+        # Desconectar en paralelo; los errores individuales se ignoran
+        await asyncio.gather(*(self.disconnect(a) for a in addrs), return_exceptions=True)
             
+    async def wait_until_disconnected(self, address: str) -> None:
+        """Retorna cuando `address` deja de estar CONNECTED (caída del enlace o desconexión pedida)."""
+        managed = self._connections.get(address)
+        while managed is not None and managed.state is ConnState.CONNECTED:
+            await managed.state_changed.wait()
+
+    async def get_char(self, address: str, uuid: str) -> BleakGATTCharacteristic:
+        """
+        Retorna la característica GATT `uuid` del dispositivo, resuelta una sola vez por conexión.
+        Pasar el objeto a read_gatt_char/start_notify evita que bleak busque el UUID en cada lectura.
+        Lanza BLENotConnectedError si no hay conexión para `address`, BLEAmbiguousCharacteristicError
+        si varias características comparten el UUID y BleakCharacteristicNotFoundError si no existe.
+        """
+        managed = self._connections.get(address)
+        if managed is None:
+            raise BLENotConnectedError(f"No existe conexión persistente para {address}")
+        char = managed.chars.get(uuid)
+        if char is None:
+            try:
+                services = managed.client.services
+            except BleakError as e:
+                # Sin descubrimiento de servicios en esta conexión: el dispositivo no está conectado
+                raise BLENotConnectedError(str(e)) from e
+            try:
+                char = services.get_characteristic(uuid)
+            except BleakError as e:
+                # bleak solo lanza aquí cuando el UUID coincide con varias características
+                raise BLEAmbiguousCharacteristicError(f"{uuid}: {e}") from e
+            if char is None:
+                raise BleakCharacteristicNotFoundError(uuid)
+            managed.chars[uuid] = char
+        return char
+
     async def get_client(self, address: str) -> Optional[BleakClient]:
-        """Retorna el cliente BLE para un address específico, si existe."""
-        async with self._global_lock:
-            managed = self._connections.get(address)
-            return managed.client if managed else None
+        """Retorna el cliente BLE para un address específico, si existe (lectura sin lock)."""
+        managed = self._connections.get(address)
+        return managed.client if managed else None
 
 
 manager = BLEConnectionManager()
 
+# Segundos que se sigue escaneando tras la primera coincidencia por nombre
+SCAN_GATHER_WINDOW_S = 1.5
+
+
+async def scan_by_name(
+    name: str,
+    timeout: float,
+    gather_window: float = 0.0,
+) -> List[Tuple[BLEDevice, Optional[int]]]:
+    """
+    Escanea en modo callback buscando dispositivos cuyo nombre coincida exactamente con `name`
+    (case-insensitive) y detiene el escaneo en cuanto aparece la primera coincidencia,
+    en lugar de esperar siempre los `timeout` segundos completos.
+    - gather_window: segundos extra tras la primera coincidencia para recoger otros
+      dispositivos con el mismo nombre (y comparar su RSSI).
+    Retorna pares (device, rssi) sin duplicados por address.
+    """
+    target = name.strip().lower()
+    found: Dict[str, Tuple[BLEDevice, Optional[int]]] = {}
+    first_match = asyncio.Event()
+
+    def on_advertisement(device: BLEDevice, adv) -> None:
+        dname = device.name
+        if dname and dname.strip().lower() == target:
+            found[device.address] = (device, adv.rssi)
+            first_match.set()
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    scanner = BleakScanner(detection_callback=on_advertisement)
+    await scanner.start()
+    try:
+        try:
+            await asyncio.wait_for(first_match.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        else:
+            # Ventana corta para recoger otras coincidencias sin pasarse del timeout
+            remaining = min(gather_window, deadline - loop.time())
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+    finally:
+        await scanner.stop()
+
+    return list(found.values())
+
+
+class ScanCache:
+    """
+    Cache en memoria de escaneos BLE recientes.
+    - Un resultado se reutiliza mientras tenga menos de `timeout / 2` segundos.
+    - Single-flight: si ya hay un escaneo en curso con la misma clave, los demás
+      requests esperan ese mismo escaneo en lugar de lanzar otro en la radio.
+      Un escaneo completo también se une a uno en curso con `timeout` mayor (ve un superconjunto).
+    Los resultados son compartidos entre requests: no deben modificarse.
+    """
+    def __init__(self) -> None:
+        # key -> (expira_en, resultado); las entradas vencidas se eliminan (ver `_evict_stale`)
+        self._scan_cache: Dict[Hashable, Tuple[float, list]] = {}
+        self._scan_inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def get(self, timeout: float) -> List[Tuple[BLEDevice, Optional[int]]]:
+        """Escaneo completo (BleakScanner.discover) de `timeout` segundos, como pares (device, rssi)."""
+        async def discover() -> List[Tuple[BLEDevice, Optional[int]]]:
+            # return_adv: dict address -> (device, adv), sin duplicados por construcción
+            found = await BleakScanner.discover(timeout=timeout, return_adv=True)
+            return [(d, adv.rssi) for d, adv in found.values()]
+
+        key = float(timeout)
+        if not self._is_fresh(key):
+            # Redondear hacia arriba al escaneo completo en curso más corto que cubra este timeout,
+            # así el adaptador no corre dos discover en paralelo
+            key = min((k for k in self._scan_inflight if isinstance(k, float) and k >= key), default=key)
+        return await self._get(key, key, discover)
+
+    async def get_by_name(
+        self,
+        name: str,
+        timeout: float,
+        gather_window: float = 0.0,
+    ) -> List[Tuple[BLEDevice, Optional[int]]]:
+        """Escaneo por nombre (ver `scan_by_name`)."""
+        key = (name.strip().lower(), timeout, gather_window)
+        return await self._get(key, timeout, lambda: scan_by_name(name, timeout, gather_window))
+
+    def _is_fresh(self, key: Hashable) -> bool:
+        cached = self._scan_cache.get(key)
+        return cached is not None and time.monotonic() < cached[0]
+
+    def _evict_stale(self) -> None:
+        """Elimina las entradas vencidas: las claves vienen del cliente (timeout, nombre), así que
+        sin esto el dict crecería con cada consulta distinta."""
+        now = time.monotonic()
+        stale = [k for k, (expires_at, _) in self._scan_cache.items() if now >= expires_at]
+        for k in stale:
+            del self._scan_cache[k]
+
+    async def _get(self, key: Hashable, timeout: float, scan: Callable[[], Awaitable[list]]) -> list:
+        if self._is_fresh(key):
+            return self._scan_cache[key][1]
+
+        task = self._scan_inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(key, timeout / 2, scan))
+            self._scan_inflight[key] = task
+        # shield: si un request se cancela, el escaneo sigue para los demás
+        return await asyncio.shield(task)
+
+    async def _run(self, key: Hashable, ttl: float, scan: Callable[[], Awaitable[list]]) -> list:
+        try:
+            result = await scan()
+            self._evict_stale()
+            # No se cachean resultados vacíos para que un reintento vuelva a escanear
+            if result:
+                self._scan_cache[key] = (time.monotonic() + ttl, result)
+            return result
+        finally:
+            self._scan_inflight.pop(key, None)
+
+
+scan_cache = ScanCache()
+
+
+# Antigüedad máxima (segundos) de un anuncio en el cache del escáner de fondo
+ADV_CACHE_MAX_AGE_S = 30.0
+
+
+@dataclass(eq=False)
+class _NameWaiter:
+    """Búsqueda por nombre pendiente en el escáner de fondo (coincidencias address -> (device, rssi))."""
+    found: Dict[str, Tuple[BLEDevice, Optional[int]]] = field(default_factory=dict)
+    first_match: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class AdvertisementCache:
+    """
+    Escáner BLE de fondo (uno solo para todo el servidor) que mantiene un mapa
+    address -> (device, last_seen, rssi) con los anuncios recibidos.
+    Los endpoints leen el mapa en lugar de lanzar un escaneo por request:
+    un request con `timeout` devuelve los dispositivos vistos en los últimos `timeout` segundos.
+    """
+    def __init__(self) -> None:
+        self._adv_cache: Dict[str, Tuple[BLEDevice, float, Optional[int]]] = {}
+        self._scanner: Optional[BleakScanner] = None
+        self._started_at = 0.0
+        self._last_prune = 0.0
+        # nombre normalizado -> búsquedas esperando ese nombre
+        self._name_waiters: Dict[str, List[_NameWaiter]] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._scanner is not None
+
+    async def start(self) -> None:
+        scanner = BleakScanner(detection_callback=self._on_advertisement)
+        await scanner.start()
+        self._scanner = scanner
+        self._started_at = time.monotonic()
+
+    async def stop(self) -> None:
+        scanner, self._scanner = self._scanner, None
+        if scanner is not None:
+            await scanner.stop()
+
+    def _on_advertisement(self, device: BLEDevice, adv) -> None:
+        now = time.monotonic()
+        self._adv_cache[device.address] = (device, now, adv.rssi)
+        # El escáner corre siempre aunque nadie lea el mapa (y las direcciones privadas rotan):
+        # purgar también aquí, como mucho una vez cada ADV_CACHE_MAX_AGE_S
+        if now - self._last_prune >= ADV_CACHE_MAX_AGE_S:
+            self._prune(now)
+        # Solo se compara el dispositivo nuevo contra los nombres buscados (sin recorrer el mapa)
+        if self._name_waiters and device.name:
+            for waiter in self._name_waiters.get(device.name.strip().lower(), ()):
+                waiter.found[device.address] = (device, adv.rssi)
+                waiter.first_match.set()
+
+    def _recent(self, max_age: float) -> List[Tuple[BLEDevice, Optional[int]]]:
+        """Dispositivos vistos en los últimos `max_age` segundos; purga los demasiado viejos."""
+        now = time.monotonic()
+        self._prune(now)
+        return [(d, rssi) for d, seen, rssi in self._adv_cache.values() if now - seen <= max_age]
+
+    def _prune(self, now: float) -> None:
+        """Elimina las entradas no vistas en los últimos ADV_CACHE_MAX_AGE_S segundos."""
+        stale = [a for a, (_, seen, _) in self._adv_cache.items() if now - seen > ADV_CACHE_MAX_AGE_S]
+        for a in stale:
+            del self._adv_cache[a]
+        self._last_prune = now
+
+    async def devices(self, timeout: float) -> List[Tuple[BLEDevice, Optional[int]]]:
+        """
+        Retorna los dispositivos vistos en los últimos `timeout` segundos.
+        Si el escáner lleva menos de `timeout` segundos activo, espera el resto.
+        """
+        remaining = self._started_at + timeout - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+        return self._recent(timeout)
+
+    async def find_by_name(
+        self,
+        name: str,
+        timeout: float,
+        gather_window: float = 0.0,
+    ) -> List[Tuple[BLEDevice, Optional[int]]]:
+        """
+        Busca dispositivos cuyo nombre coincida exactamente con `name` (case-insensitive).
+        Si ya están en el cache retorna de inmediato; si no, espera anuncios nuevos hasta
+        `timeout` segundos, más `gather_window` tras la primera coincidencia.
+        """
+        target = name.strip().lower()
+        matches = [
+            (d, rssi) for d, rssi in self._recent(timeout)
+            if d.name and d.name.strip().lower() == target
+        ]
+        if matches:
+            return matches
+
+        # Registrar la búsqueda: _on_advertisement agrega cada coincidencia nueva a `waiter.found`
+        waiter = _NameWaiter()
+        self._name_waiters.setdefault(target, []).append(waiter)
+        try:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            try:
+                await asyncio.wait_for(waiter.first_match.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+
+            # Ventana corta para recoger otras coincidencias sin pasarse del timeout
+            remaining = min(gather_window, deadline - loop.time())
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+        finally:
+            waiters = self._name_waiters[target]
+            waiters.remove(waiter)
+            if not waiters:
+                del self._name_waiters[target]
+        return list(waiter.found.values())
+
+
+adv_cache = AdvertisementCache()
+
+
+async def recent_devices(timeout: float) -> List[Tuple[BLEDevice, Optional[int]]]:
+    """
+    Dispositivos vistos en los últimos `timeout` segundos como pares (device, rssi).
+    Usa el escáner de fondo; si no está activo, escanea bajo demanda (ScanCache).
+    """
+    if adv_cache.running:
+        return await adv_cache.devices(timeout)
+    return await scan_cache.get(timeout)
+
+
+async def find_by_name(
+    name: str,
+    timeout: float,
+    gather_window: float = 0.0,
+) -> List[Tuple[BLEDevice, Optional[int]]]:
+    """
+    Dispositivos cuyo nombre coincide exactamente con `name`, como pares (device, rssi).
+    Usa el escáner de fondo; si no está activo, escanea bajo demanda (ScanCache).
+    """
+    if adv_cache.running:
+        return await adv_cache.find_by_name(name, timeout, gather_window)
+    return await scan_cache.get_by_name(name, timeout, gather_window)
+
+
+@api.on_event("startup")
+async def startup_event():
+    """
+    Evento de inicio del servidor.
+    Arranca el escáner BLE de fondo. Si no hay adaptador disponible, los endpoints
+    vuelven a escanear bajo demanda.
+    """
+    try:
+        await adv_cache.start()
+    except Exception:
+        pass
+
 
 @api.on_event("shutdown")
 async def shutdown_event():
     """
     Evento de cierre del servidor.
-    Intenta desconectar todas las conexiones persistentes de forma ordenada.
+    Detiene el escáner de fondo e intenta desconectar todas las conexiones persistentes de forma ordenada.
     """
+    try:
+        await adv_cache.stop()
+    except Exception:
+        pass
     await manager.disconnect_all()
 
 
@@ -239,7 +665,7 @@ async def shutdown_event():
 # Endpoints existentes (tuyos)
 # -----------------------
 
-@api.get("/ble/scan", response_model=List[BLEDeviceOut])
+@api.get("/ble/scan", response_model=List[BLEDeviceOut], response_model_exclude_none=True)
 async def scan_ble(
     timeout: float = Query(
         5.0,
@@ -249,30 +675,13 @@ async def scan_ble(
     )
 ):  # ge = greater equal, le = less equal
     """
-    Escanea dispositivos BLE durante `timeout` segundos y devuelve
-    nombre, address e RSSI de cada dispositivo encontrado.
+    Devuelve nombre, address e RSSI de los dispositivos BLE vistos durante
+    los últimos `timeout` segundos (escáner de fondo, o escaneo bajo demanda si no está activo).
     """
-    devices = await BleakScanner.discover(timeout=timeout)
-
-    results: List[BLEDeviceOut] = []
-    seen = set()
-
-    for d in devices:
-        addr = getattr(d, "address", None)
-        # Evitar duplicados
-        if not addr or addr in seen:
-            continue
-        seen.add(addr)
-
-        results.append(
-            BLEDeviceOut(
-                name=d.name or None,
-                address=addr,
-                rssi=getattr(d, "rssi", None),
-            )
-        )
-
-    return results
+    # Ambas fuentes (escáner de fondo y discover con return_adv) ya vienen sin duplicados por address
+    devices = await recent_devices(timeout)
+    # Datos internos ya saneados: model_construct evita la validación de pydantic por dispositivo
+    return [BLEDeviceOut.model_construct(name=d.name or None, address=d.address, rssi=rssi) for d, rssi in devices]
 
 
 @api.get("/ble/name", response_model=Union[BLEDevicesFound, BLEDeviceNotFound])
@@ -281,19 +690,13 @@ async def get_addresses_by_name(
     timeout: float = Query(5.0, ge=1.0, le=30.0, description="Tiempo de escaneo en segundos"),
 ):
     """
-    Escanea dispositivos BLE durante `timeout` segundos y devuelve
+    Escanea dispositivos BLE hasta `timeout` segundos y devuelve
     las direcciones MAC de los dispositivos que coincidan exactamente con `name`.
-    La búsqueda es case-insensitive.
+    La búsqueda es case-insensitive y termina en cuanto aparece una coincidencia.
     """
-    devices = await BleakScanner.discover(timeout=timeout)
-
-    target = name.strip().lower()
-    addresses: List[str] = []
-
-    for d in devices:
-        dname = (d.name or "").strip().lower()
-        if dname == target:
-            addresses.append(d.address)
+    matches = await find_by_name(name, timeout)
+    addresses = [d.address for d, _ in matches]
+    manager.remember_name(name, [(d.address, rssi) for d, rssi in matches])
 
     if not addresses:
         return BLEDeviceNotFound(message="Dispositivo no encontrado")
@@ -307,9 +710,85 @@ async def get_addresses_by_name(
 # NUEVO: conexión persistente por nombre
 # -----------------------
 
+def rank_by_rssi(candidates: List[Tuple[str, Optional[int]]]) -> List[Tuple[str, Optional[int]]]:
+    """
+    Ordena pares (address, rssi) por RSSI: mejor señal primero (valores más cercanos a 0 son mejores).
+    None se coloca al final (centinela -999, por debajo de cualquier RSSI real). El orden se calcula
+    con un único argsort estable en NumPy, así que los empates conservan el orden del escaneo.
+    """
+    rssis = np.fromiter(
+        (rssi if rssi is not None else -999 for _, rssi in candidates),
+        dtype=np.int16,
+        count=len(candidates),
+    )
+    order = np.argsort(-rssis, kind="stable")
+    return [candidates[i] for i in order]
+
+
+async def connect_first(
+    candidates: List[Tuple[str, Optional[int]]],
+    connect_timeout: float,
+    name: str,
+    errors: List[str],
+) -> Tuple[Optional[Tuple[str, Optional[int]]], List[str]]:
+    """
+    Conecta al primero de `candidates` (pares (address, rssi) ordenados por RSSI) que lo logre.
+    - Si alguno ya está conectado, se reutiliza sin lanzar nuevas conexiones.
+    - Si no, intenta todos en paralelo; gana el primero que conecte y se cancela el resto.
+    Agrega a `errors` los fallos y retorna (ganador o None, addresses que fallaron).
+    """
+    for address, rssi in candidates:
+        if await manager.is_connected(address):
+            return (address, rssi), []
+
+    tasks = {
+        asyncio.create_task(
+            manager.connect_persistent(address=address, connect_timeout=connect_timeout, name=name)
+        ): (address, rssi)
+        for address, rssi in candidates
+    }
+    pending = set(tasks)
+    winner: Optional[Tuple[str, Optional[int]]] = None
+    failed: List[str] = []
+    extra: List[str] = []
+
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Recorrer en orden de RSSI por si terminan varios a la vez
+            for task in (t for t in tasks if t in done):
+                address, rssi = tasks[task]
+                try:
+                    ok = task.result()
+                except (BleakError, Exception) as e:
+                    failed.append(address)
+                    errors.append(f"{address}: {type(e).__name__}: {str(e)}")
+                    continue
+                if not ok:
+                    failed.append(address)
+                    errors.append(f"{address}: connect ok pero is_connected=False")
+                elif winner is None:
+                    winner = (address, rssi)
+                else:
+                    extra.append(address)
+    finally:
+        pending = list(pending)
+        for task in pending:
+            task.cancel()
+        # Esperar a que los cancelados limpien su estado; alguno pudo conectar justo antes
+        late = await asyncio.gather(*pending, return_exceptions=True)
+        extra.extend(tasks[t][0] for t, ok in zip(pending, late) if ok is True)
+        # Evitar sesiones BLE duplicadas: solo se queda la conexión ganadora
+        if extra:
+            await asyncio.gather(*(manager.disconnect(a) for a in extra), return_exceptions=True)
+
+    return winner, failed
+
+
 @api.post(
     "/ble/connect/persistent",
-    response_model=Union[BLEConnectPersistentSuccess, BLEDeviceNotFound, BLEConnectPersistentFailed]
+    response_model=Union[BLEConnectPersistentSuccess, BLEDeviceNotFound, BLEConnectPersistentFailed],
+    response_model_exclude_none=True,
 )
 async def connect_persistent_by_name(
     name: str = Query(..., min_length=1, description="Nombre exacto del dispositivo BLE"),
@@ -320,57 +799,47 @@ async def connect_persistent_by_name(
     Escanea dispositivos BLE por `scan_timeout` segundos, busca coincidencia exacta por `name`
     y establece una conexión persistente (se queda conectada en memoria del servidor).
 
-    - Si hay varios dispositivos con el mismo nombre, intenta primero el de mejor RSSI (si existe).
+    - Si `name` se encontró hace menos de `scan_timeout * 3` segundos, primero intenta con esas
+      addresses sin escanear; solo si fallan vuelve a escanear.
+    - Si hay varios dispositivos con el mismo nombre, intenta conectar a todos en paralelo y se queda
+      con el primero que conecte (si terminan a la vez, el de mejor RSSI); el resto se cancela.
     - Si no encuentra el dispositivo: devuelve "Dispositivo no encontrado".
     - Si encuentra pero no logra conectarse a ninguno: devuelve "No se pudo conectar".
     """
-    devices = await BleakScanner.discover(timeout=scan_timeout)
-    target = name.strip().lower()
-
-    # Filtrar dispositivos que coinciden con el nombre
-    matches = []
-    for d in devices:
-        dname = (d.name or "").strip().lower()
-        if dname == target:
-            matches.append(d)
-
-    if not matches:
-        return BLEDeviceNotFound(message="Dispositivo no encontrado")
-
-    # Ordenar por RSSI: mejor señal primero (valores más cercanos a 0 son mejores)
-    # None se coloca al final
-    def rssi_sort_key(dev):
-        rssi = getattr(dev, "rssi", None)
-        return (rssi is None, -(rssi if rssi is not None else -9999))
-
-    matches.sort(key=rssi_sort_key)
+    def success(address: str, rssi: Optional[int]) -> BLEConnectPersistentSuccess:
+        return BLEConnectPersistentSuccess(
+            message="Conexión persistente establecida",
+            name=name,
+            address=address,
+            is_connected=True,
+            rssi=rssi
+        )
 
     attempted_addresses: List[str] = []
     errors: List[str] = []
 
-    # Intentar conectar a cada dispositivo encontrado
-    for dev in matches:
-        address = dev.address
-        attempted_addresses.append(address)
-        try:
-            ok = await manager.connect_persistent(
-                address=address,
-                connect_timeout=connect_timeout,
-                name=name
-            )
-            if ok:
-                # Conexión exitosa
-                return BLEConnectPersistentSuccess(
-                    message="Conexión persistente establecida",
-                    name=name,
-                    address=address,
-                    is_connected=True,
-                    rssi=getattr(dev, "rssi", None)
-                )
-            else:
-                errors.append(f"{address}: connect ok pero is_connected=False")
-        except (BleakError, Exception) as e:
-            errors.append(f"{address}: {type(e).__name__}: {str(e)}")
+    # Camino rápido: addresses ya conocidas para este nombre, sin escanear
+    cached = rank_by_rssi(manager.cached_name(name, scan_timeout * 3))
+    if cached:
+        attempted_addresses.extend(address for address, _ in cached)
+        winner, failed = await connect_first(cached, connect_timeout, name, errors)
+        manager.forget_name_addresses(name, failed)
+        if winner is not None:
+            return success(*winner)
+
+    # El escaneo termina poco después de la primera coincidencia (ventana para comparar RSSI)
+    matches = await find_by_name(name, scan_timeout, gather_window=SCAN_GATHER_WINDOW_S)
+
+    if matches:
+        candidates = rank_by_rssi([(dev.address, rssi) for dev, rssi in matches])
+        manager.remember_name(name, candidates)
+        attempted_addresses.extend(address for address, _ in candidates)
+        winner, failed = await connect_first(candidates, connect_timeout, name, errors)
+        manager.forget_name_addresses(name, failed)
+        if winner is not None:
+            return success(*winner)
+    elif not attempted_addresses:
+        return BLEDeviceNotFound(message="Dispositivo no encontrado")
 
     # Todos los intentos fallaron
     return BLEConnectPersistentFailed(
@@ -401,6 +870,30 @@ async def connect_persistent_by_address(
         raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
 
 
+@api.post("/ble/connect/batch", response_model=List[BLEConnectBatchResult], response_model_exclude_none=True)
+async def connect_persistent_batch(items: List[BLEConnectBatchItem]):
+    """
+    Establece conexiones persistentes para varios addresses en un solo request.
+    Las conexiones se intentan en paralelo; el fallo de una no afecta a las demás.
+    """
+    outcomes = await asyncio.gather(
+        *(manager.connect_persistent(address=it.address, connect_timeout=it.connect_timeout) for it in items),
+        return_exceptions=True,
+    )
+
+    results: List[BLEConnectBatchResult] = []
+    for it, outcome in zip(items, outcomes):
+        if isinstance(outcome, BaseException):
+            results.append(BLEConnectBatchResult(
+                address=it.address,
+                is_connected=False,
+                error=f"{type(outcome).__name__}: {str(outcome)}"
+            ))
+        else:
+            results.append(BLEConnectBatchResult(address=it.address, is_connected=outcome))
+    return results
+
+
 @api.post("/ble/disconnect", response_model=BLEDisconnectResponse)
 async def disconnect_device(
     address: str = Query(..., min_length=1, description="Address (MAC/ID) del dispositivo BLE"),
@@ -436,14 +929,82 @@ async def list_connections():
     y su estado actual (conectado/desconectado).
     """
     addrs = await manager.get_connections()
-    statuses: List[BLEConnectionStatus] = []
-    for a in addrs:
-        statuses.append(BLEConnectionStatus(address=a, is_connected=await manager.is_connected(a)))
-    return BLEConnectionsList(connections=statuses)
+    # Consultar el estado de todas las conexiones en paralelo
+    flags = await asyncio.gather(*(manager.is_connected(a) for a in addrs))
+    # Payload interno de tipos conocidos: se construye sin validación (model_construct)
+    statuses = [BLEConnectionStatus.model_construct(address=a, is_connected=f) for a, f in zip(addrs, flags)]
+    return BLEConnectionsList.model_construct(connections=statuses)
+
+@api.get("/ble/connections/stream")
+async def stream_connections():
+    """
+    Igual que /ble/connections pero en streaming NDJSON (un BLEConnectionStatus por línea),
+    enviando cada estado en cuanto su consulta termina.
+    """
+    addrs = await manager.get_connections()
+
+    async def status(a: str) -> BLEConnectionStatus:
+        return BLEConnectionStatus.model_construct(address=a, is_connected=await manager.is_connected(a))
+
+    async def ndjson():
+        for next_status in asyncio.as_completed([status(a) for a in addrs]):
+            yield orjson.dumps((await next_status).model_dump()) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
 
 # UUID por defecto para características PPG
 PPG_CHAR_UUID_DEFAULT = "2A39"
 
+# Ventana PPG: 64 muestras uint16 little-endian (128 bytes)
+PPG_WINDOW_SAMPLES = 64
+_BIG_ENDIAN_HOST = sys.byteorder == "big"
+
+
+def decode_ppg_window(raw: Union[bytes, bytearray]) -> np.ndarray:
+    """
+    Decodifica una ventana PPG cruda (64 uint16 little-endian) a un ndarray uint16 en el orden
+    de bytes nativo del host. Es la única decodificación usada por REST y WebSocket.
+    En hosts little-endian es una vista sin copia sobre `raw`; en big-endian se hace un byteswap
+    vectorizado. Los consumidores (hrs_analysis_tools) siempre reciben uint16 nativo.
+    Lanza ValueError si `raw` no mide exactamente 128 bytes (como hacía struct.unpack("<64H")).
+    """
+    if len(raw) != 2 * PPG_WINDOW_SAMPLES:
+        raise ValueError(f"Ventana PPG de {len(raw)} bytes, se esperaban {2 * PPG_WINDOW_SAMPLES}")
+    arr = np.frombuffer(raw, dtype="<u2")
+    if _BIG_ENDIAN_HOST:
+        arr = arr.byteswap().view(arr.dtype.newbyteorder())
+    return arr
+
+
+def _ppg_message(payload: dict) -> str:
+    """
+    Serializa un mensaje del websocket PPG con orjson: los arrays NumPy se codifican
+    directamente en C (sin .astype(int).tolist()). Se envía como frame de texto JSON.
+    """
+    return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
+# Frame binario del WebSocket PPG (format=binary), little-endian:
+#   <B len(address)><address ASCII><B len(char_uuid)><char_uuid ASCII>
+#   <d unix_time><I start_index><H n_samples><n_samples x u2 samples>
+# El prefijo address/uuid es fijo por sesión; este Struct es la parte fija que sigue
+_PPG_FRAME_HEADER = struct.Struct("<dIH")
+
+
+def _ppg_frame_prefix(address: str, char_uuid: str) -> bytes:
+    """Prefijo constante del frame binario: address y char_uuid con su longitud (1 byte cada una)."""
+    a = address.encode("ascii")
+    u = char_uuid.encode("ascii")
+    return bytes([len(a)]) + a + bytes([len(u)]) + u
+
+
+# Capacidad inicial (muestras) del arreglo agregado de cada sesión WebSocket
+PPG_AGGREGATED_INITIAL_CAPACITY = 4096
+
+# Arreglo agregado de la sesión WebSocket activa de cada address (lo actualiza /ws/ble/ppg,
+# lo lee /ble/ppg/snapshot). Se admite una sola sesión por address y la entrada se elimina al cerrarla
+_ppg_aggregates: Dict[str, np.ndarray] = {}
+
 @api.get("/ble/ppg/read", response_model=PPGReadResponse)
 async def read_ppg_window(
     address: str = Query(..., min_length=1, description="Address (MAC/ID) del dispositivo BLE"),
@@ -457,31 +1018,64 @@ async def read_ppg_window(
     """
 
     client = await manager.get_client(address)
-    if not client or not await manager.is_connected(address):
+    if client is None:
         raise HTTPException(status_code=400, detail="No existe conexión persistente para ese address")
 
+    # Sin consultar is_connected antes: se intenta la lectura y, si el enlace se cayó,
+    # bleak lo indica con BleakError/EOFError (mapeado a 400)
     try:
         # Leer datos brutos de la característica (128 bytes = 64 uint16)
-        raw = await client.read_gatt_char(char_uuid)
-        # Desempacar como 64 valores uint16 en formato little-endian
-        samples = list(struct.unpack("<64H", raw))
+        char = await manager.get_char(address, char_uuid)
+        raw = await client.read_gatt_char(char)
+        # Decodificar como 64 valores uint16 (little-endian en el cable, nativo en memoria)
+        samples = decode_ppg_window(raw).tolist()
         return PPGReadResponse(
             address=address,
             char_uuid=char_uuid,
             unix_time=time.time(),
             samples=samples,
         )
+    except BLEAmbiguousCharacteristicError as e:
+        # UUID que no identifica una sola característica: error del cliente, no de conexión
+        raise HTTPException(status_code=400, detail=f"UUID de característica ambiguo: {str(e)}")
+    except BleakCharacteristicNotFoundError as e:
+        # Subclase de BleakError, pero no es un problema de conexión
+        raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
+    except (BleakError, EOFError) as e:
+        raise HTTPException(status_code=400, detail=f"Dispositivo no conectado: {type(e).__name__}: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
 
 
+@api.get("/ble/ppg/snapshot", response_model=PPGSnapshotResponse)
+async def ppg_snapshot(
+    address: str = Query(..., min_length=1, description="Address (MAC/ID) del dispositivo BLE"),
+):
+    """
+    Devuelve el arreglo PPG agregado completo de la sesión WebSocket activa para `address`.
+    Pensado para que un cliente del WebSocket se resincronice si perdió mensajes.
+    """
+    aggregated = _ppg_aggregates.get(address)
+    if aggregated is None:
+        raise HTTPException(status_code=404, detail="No hay datos PPG agregados para ese address")
+    # ORJSONResponse serializa el ndarray uint16 directamente (OPT_SERIALIZE_NUMPY), sin .tolist().
+    # Se serializa al construir la respuesta, sin await de por medio: el merge (que corre en el
+    # event loop) no puede reescribir el buffer a mitad de la copia
+    return ORJSONResponse({
+        "address": address,
+        "aggregated_len": len(aggregated),
+        "aggregated": aggregated,
+    })
+
+
 @api.websocket("/ws/ble/ppg")
 async def ws_ble_ppg(
     websocket: WebSocket,
     address: str,
     interval_ms: int = 2000,
     char_uuid: str = PPG_CHAR_UUID_DEFAULT,
-    send_full_aggregated: bool = False,
+    notify: bool = True,
+    format: Literal["json", "binary"] = "json",
 ):
 
     """
@@ -490,18 +1084,31 @@ async def ws_ble_ppg(
     
     Parámetros:
     - address: Address (MAC/ID) del dispositivo BLE
-    - interval_ms: intervalo entre lecturas en milisegundos (mínimo 50 ms)
+    - interval_ms: intervalo entre lecturas en milisegundos (mínimo 50 ms), solo en modo polling
     - char_uuid: UUID/short UUID de la característica (ej: 2A39)
-    - send_full_aggregated: si es True, envía también el arreglo completo agregado en cada mensaje
+    - notify: si es True (por defecto) y la característica soporta notificaciones, se suscribe
+      (start_notify) y envía cada ventana en cuanto llega; si es False o no hay notify, hace polling
+      con read_gatt_char cada interval_ms
+    - format: "json" (por defecto, frames de texto) o "binary" (frames binarios compactos, ver abajo)
     
+    Protocolo: cada mensaje trae solo el delta. El cliente mantiene el arreglo agregado
+    colocando `new_samples` a partir de `start_index` (si `start_index` es menor que lo que ya
+    tiene, descarta su cola desde ahí: el servidor reemplazó el final del agregado). Para resincronizar
+    (p. ej. tras perder mensajes) se usa GET /ble/ppg/snapshot?address=...
+
     Mensajes enviados (JSON):
     - address: address del dispositivo
     - char_uuid: UUID/short UUID de la característica
     - unix_time: timestamp de la lectura
+    - start_index: posición en el arreglo agregado donde empiezan las nuevas muestras
     - new_samples: nuevas muestras agregadas en esta lectura (lista de int)
     - aggregated_len: longitud total del arreglo agregado hasta ahora
-    - aggregated: (opcional) arreglo completo agregado (lista de int), si send_full_aggregated es True
+    - drift_ms: (solo polling) retraso de la lectura respecto a su instante programado (cadencia interval_ms)
     - error: en caso de error, mensaje de error
+
+    Con format=binary cada ventana se envía como un frame binario little-endian:
+    <B len(address)><address><B len(char_uuid)><char_uuid><d unix_time><I start_index><H n_samples><n_samples x uint16>
+    (aggregated_len = start_index + n_samples). Los errores siguen llegando como JSON de texto.
     """
 
     await websocket.accept()
@@ -512,58 +1119,139 @@ async def ws_ble_ppg(
         await websocket.close(code=1008)
         return
 
+    if address in _ppg_aggregates:
+        # Una segunda sesión pisaría el agregado de la primera (y su start_index dejaría de
+        # corresponder al de /ble/ppg/snapshot)
+        await websocket.send_json({"error": "Ya hay una sesión PPG activa para ese address"})
+        await websocket.close(code=1008)
+        return
+
     # Convertir milisegundos a segundos, con mínimo de 50 ms
     interval_s = max(0.05, interval_ms / 1000.0)
 
-    # Variables para rastrear datos agregados
-    last_arr = None
-    aggregated = None
-    prev_len = 0
-
+    # Arreglo agregado preasignado: aggregated[:n] son los datos válidos y la capacidad se duplica
+    # al llenarse, así cada lectura copia solo las muestras nuevas (no todo el arreglo)
+    aggregated = np.empty(PPG_AGGREGATED_INITIAL_CAPACITY, dtype=np.uint16)
+    n = 0
+
+    # Dos buffers fijos de una ventana (ping-pong): `frame` recibe la lectura actual y `last_arr`
+    # conserva la anterior; al final de cada iteración se intercambian, sin asignar arrays nuevos
+    frame = np.empty(PPG_WINDOW_SAMPLES, dtype=np.uint16)
+    last_arr = np.empty(PPG_WINDOW_SAMPLES, dtype=np.uint16)
+
+    queue: Optional[asyncio.Queue] = None
+    disconnect_task: Optional[asyncio.Task] = None
+    link_task: Optional[asyncio.Task] = None
+
+    frame_prefix = b""
+
+    async def send_window(start_index: int, samples: np.ndarray, extra: dict) -> None:
+        """Envía las muestras nuevas (aggregated[start_index:start_index + len(samples)])."""
+        if format == "binary":
+            await websocket.send_bytes(b"".join((
+                frame_prefix,
+                _PPG_FRAME_HEADER.pack(time.time(), start_index, len(samples)),
+                samples.astype("<u2", copy=False).tobytes(),
+            )))
+        else:
+            await websocket.send_text(_ppg_message({
+                "address": address,
+                "char_uuid": char_uuid,
+                "unix_time": time.time(),
+                "start_index": start_index,
+                "new_samples": samples,
+                "aggregated_len": start_index + len(samples),
+                **extra,
+            }))
+
+    # Registrar la sesión (sin await desde la comprobación de arriba); el finally la elimina
+    _ppg_aggregates[address] = aggregated[:0]
     try:
+        # Dentro del try: un char_uuid no ASCII o de más de 255 bytes falla aquí y se reporta como error
+        if format == "binary":
+            frame_prefix = _ppg_frame_prefix(address, char_uuid)
+
+        # Modo notificaciones: el dispositivo empuja cada ventana nueva (sin lecturas repetidas
+        # cuando no hay cambios). Si la característica no soporta notify, se usa polling.
+        # Característica resuelta una sola vez (no en cada lectura)
+        char = await manager.get_char(address, char_uuid)
+        if notify and "notify" in char.properties:
+            queue = asyncio.Queue()
+            await client.start_notify(char, lambda _c, data: queue.put_nowait(bytes(data)))
+
+        async def wait_disconnect() -> None:
+            # En modo notify no se envía nada si no hay datos: hay que escuchar el cierre del cliente
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+
+        if queue is not None:
+            disconnect_task = asyncio.create_task(wait_disconnect())
+            # Si el enlace BLE se cae no llegan más notificaciones: vigilar el estado de la conexión
+            link_task = asyncio.create_task(manager.wait_until_disconnected(address))
+
+        # Planificador por deadline (modo polling): cada lectura arranca en next_tick, sin acumular
+        # la latencia de lectura/envío como haría un sleep(interval) fijo
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+
         while True:
-            # Leer datos PPG del dispositivo
-            raw = await client.read_gatt_char(char_uuid)
-            arr = np.array(struct.unpack("<64H", raw), dtype=np.uint16)
+            extra = {}
+            if queue is not None:
+                # Esperar la siguiente notificación (o el cierre del socket, o la caída del enlace BLE)
+                get_task = asyncio.create_task(queue.get())
+                await asyncio.wait(
+                    {get_task, disconnect_task, link_task}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not get_task.done():
+                    get_task.cancel()
+                    if disconnect_task.done():
+                        return
+                    # Igual que en polling (donde falla la lectura): error JSON y cierre 1011
+                    raise BleakError(f"El dispositivo {address} se desconectó")
+                raw = get_task.result()
+            else:
+                # Retraso (ms) de esta lectura respecto a su deadline, visible para el cliente
+                extra["drift_ms"] = max(0.0, (loop.time() - next_tick) * 1000.0)
+                # Leer datos PPG del dispositivo
+                raw = await client.read_gatt_char(char)
 
-            if last_arr is None:
+            # Decodificar los 64 uint16 directamente en el buffer preasignado
+            frame[:] = decode_ppg_window(raw)
+
+            if n == 0:
                 # Primera lectura: inicializar array agregado
-                last_arr = arr
-                aggregated = arr.copy()
-                prev_len = len(aggregated)
-
-                await websocket.send_json({
-                    "address": address,
-                    "char_uuid": char_uuid,
-                    "unix_time": time.time(),
-                    "new_samples": arr.astype(int).tolist(),   # primera vez: todo
-                    "aggregated_len": int(len(aggregated)),
-                })
+                n = len(frame)
+                aggregated[:n] = frame
+                _ppg_aggregates[address] = aggregated[:n]
+
+                await send_window(0, frame, extra)   # primera vez: todo
             else:
-                # Agregar solo lo nuevo usando la lógica de overlap/reset
-                aggregated = hrs_analysis_tools.add_new_data(aggregated, last_arr, arr)
-                last_arr = arr
+                if n + len(frame) > len(aggregated):
+                    grown = np.empty(2 * len(aggregated), dtype=np.uint16)
+                    grown[:n] = aggregated[:n]
+                    aggregated = grown
 
-                # Calcular segmento nuevo (desde prev_len hasta fin)
-                new_segment = aggregated[prev_len:]
-                prev_len = len(aggregated)
+                # Agregar solo lo nuevo usando la lógica de overlap/reset. Se llama directo: es un
+                # kernel NumPy vectorizado (~20 µs), más barato que el salto a un hilo (asyncio.to_thread)
+                n, start_index = hrs_analysis_tools.merge_into(aggregated, n, last_arr, frame)
+                _ppg_aggregates[address] = aggregated[:n]
 
-                payload = {
-                    "address": address,
-                    "char_uuid": char_uuid,
-                    "unix_time": time.time(),
-                    "new_samples": new_segment.astype(int).tolist(),
-                    "aggregated_len": int(len(aggregated)),
-                }
+                # Segmento nuevo: puede empezar antes del final anterior si se reemplazó la cola
+                new_segment = aggregated[start_index:n]
 
-                # Opcionalmente enviar array completo agregado
-                if send_full_aggregated:
-                    payload["aggregated"] = aggregated.astype(int).tolist()
+                await send_window(start_index, new_segment, extra)
 
-                await websocket.send_json(payload)
+            # La lectura actual pasa a ser la anterior; el buffer viejo se reutiliza en la siguiente
+            last_arr, frame = frame, last_arr
 
-            # Esperar antes de siguiente lectura
-            await asyncio.sleep(interval_s)
+            if queue is None:
+                # Esperar hasta el siguiente deadline; si vamos atrasados, no dormir y reiniciar la referencia
+                next_tick += interval_s
+                delay = next_tick - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    next_tick = loop.time()
 
     except WebSocketDisconnect:
         # Cliente cerró el socket
@@ -578,6 +1266,21 @@ async def ws_ble_ppg(
             await websocket.close(code=1011)
         except Exception:
             pass
+    finally:
+        del _ppg_aggregates[address]
+        for task in (disconnect_task, link_task):
+            if task is None:
+                continue
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Recoger su resultado (p. ej. un error de receive) para que no quede sin consultar
+                task.exception()
+        if queue is not None:
+            try:
+                await client.stop_notify(char)
+            except Exception:
+                pass
 
 
 